@@ -128,6 +128,9 @@ from github import Github
 from urllib import request
 import base64
 import codecs
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 # from http://code.activestate.com/recipes/134892/
 class _Getch:
@@ -311,6 +314,156 @@ def loop(arguments):
     if arguments:
         return arguments[0]
 
+global trace #The file that nondeterministic values are recorded to while recording
+trace = None
+
+global replaying #The recorded trace while replaying, and our position in it
+replaying = None
+replaypos = 0
+
+global sample #While recording, every sample-th operator call is also recorded; 0 records none
+sample = 0
+samplecount = 0
+
+traceheader = b"ITR1" #Every trace starts with this
+
+def encode(number):
+    """encode turns an integer into a zigzag-encoded varint so that small numbers, negative or not, take few bytes."""
+    number = number * 2 if number >= 0 else -number * 2 - 1
+    out = bytearray()
+    while number > 127:
+        out.append(number & 127 | 128)
+        number >>= 7
+    out.append(number)
+    return out
+
+def decode():
+    """decode reads the varint at the current position of the trace being replayed and returns the integer it holds."""
+    global replaypos
+    number = shift = 0
+    while True:
+        byte = replaying[replaypos]
+        replaypos += 1
+        number |= (byte & 127) << shift
+        shift += 7
+        if byte < 128:
+            break
+    return number >> 1 if not number & 1 else -(number >> 1) - 1
+
+def recording(tag, function):
+    """recording wraps the function of a nondeterministic operator so that every value it returns is written to the trace,
+       preceded by the tag byte that identifies the operator."""
+    def recorded(arguments):
+        result = function(arguments)
+        trace.write(tag + encode(result))
+        return result
+    return recorded
+
+def replayed(tag):
+    """replayed makes a function that stands in for a nondeterministic operator and returns the next value the trace holds for it.
+       Sampled operator events are skipped over."""
+    def replayer(arguments):
+        global replaypos
+        try:
+            while True:
+                current = replaying[replaypos : replaypos + 1]
+                replaypos += 1
+                if current == b"o": #A sampled operator event; the operator and its value are skipped
+                    decode()
+                    decode()
+                    continue
+                if not current:
+                    print("\nThe trace ended before the program did.")
+                    sys.exit()
+                if current != tag:
+                    print("\nThe trace does not match the program.")
+                    sys.exit()
+                return decode()
+        except IndexError:
+            print("\nThe trace is truncated.")
+            sys.exit()
+    return replayer
+
+def note(op, value):
+    """note records every sample-th operator call as an event holding the operator character and the value it returned."""
+    global samplecount
+    samplecount += 1
+    if samplecount == sample:
+        samplecount = 0
+        trace.write(b"o" + encode(ord(op[0])) + encode(int(value)))
+
+def flushtrace():
+    """flushtrace flushes the trace being recorded once a second, so that a process that is killed outright loses at most
+       the last second of it."""
+    while not trace.closed:
+        time.sleep(1)
+        try:
+            trace.flush()
+        except ValueError:
+            break #The trace was closed at exit while we slept
+
+def stoptrace(signum, frame):
+    """stoptrace is the SIGTERM handler while recording. atexit does not run when a signal ends the process, so the trace is
+       flushed here before the signal is handled as it would have been."""
+    import signal
+    try:
+        trace.flush()
+    except RuntimeError:
+        pass #The signal arrived in the middle of a write; the flushing thread has kept the trace within a second of it
+    signal.signal(signum, signal.SIG_DFL)
+    os.kill(os.getpid(), signum)
+
+def checktrace():
+    """checktrace runs at exit while replaying and warns if the program did not use all of the values in the trace."""
+    global replaypos
+    left = 0
+    try:
+        while replaypos < len(replaying):
+            current = replaying[replaypos : replaypos + 1]
+            replaypos += 1
+            if current == b"o": #Sampled operator events do not have to be used
+                decode()
+            else:
+                left += 1
+            decode()
+    except IndexError:
+        pass #The trace is truncated; we count what is there
+    if left:
+        print("\nThe program ended before the trace did; " + str(left) + " recorded values were not used.", file=sys.stderr)
+
+def starttrace(mode, path):
+    """starttrace swaps the functions of the nondeterministic operators for ones that record their values to
+       or replay them from the trace at path, depending on mode."""
+    global trace, replaying, replaypos
+    import atexit, signal
+
+    if mode == "record":
+        try:
+            trace = open(path, "wb", buffering = 65536) #The trace is only ever appended to, so a large buffer is all it needs
+        except OSError:
+            print("The trace " + path + " could not be opened.")
+            sys.exit()
+        trace.write(traceheader)
+        atexit.register(trace.close) #Flushes whatever is still buffered when the program ends normally...
+        signal.signal(signal.SIGTERM, stoptrace) #...or is told to stop...
+        threading.Thread(target = flushtrace, daemon = True).start() #...and keeps the file close behind otherwise
+        for i, tag in (("\"", b"\""), ("``", b"`"), ("[", b"[")):
+            opdict[i] = recording(tag, opdict[i])
+    else:
+        try:
+            with open(path, "rb") as file:
+                replaying = file.read()
+        except OSError:
+            print("The trace " + path + " could not be opened.")
+            sys.exit()
+        if not replaying.startswith(traceheader):
+            print("The file " + path + " is not an Integ trace.")
+            sys.exit()
+        replaypos = len(traceheader)
+        atexit.register(checktrace)
+        for i, tag in (("\"", b"\""), ("``", b"`"), ("[", b"[")):
+            opdict[i] = replayed(tag)
+
 def parse(inputstr, opconst):
     """Parses an input string according to the operator character list opconst
        and outputs, in this order, the operator, the operands, and anything else. The number of repeated
@@ -417,54 +570,58 @@ def metaparse(inputstring):
     global opdict
     
     remainder = ""
-    
-    if not inputstring: #Returns 0 if the string is empty.
-        return 0, remainder
-    
-    integer = 0
-    try: #We try to convert the input string into an integer and return the integer. If that fails,
-         #We know that we need to parse the input more.
-        integer = int(inputstring)
-        return integer, remainder
-    except ValueError:
-        pass
 
-    output = parse(inputstring, list(opdict.keys())) #Get and unpack parse output
-    
-    op = output[0]
-    arguments = output[1]
-    remainder = output[2]
+    while True: #Statements are evaluated one after another here rather than through recursion, so a long
+                #sequence of statements does not keep the frames of the earlier statements alive.
+        if not inputstring: #Returns 0 if the string is empty.
+            return 0, remainder
+        
+        integer = 0
+        try: #We try to convert the input string into an integer and return the integer. If that fails,
+             #We know that we need to parse the input more.
+            integer = int(inputstring)
+            return integer, remainder
+        except ValueError:
+            pass
+
+        output = parse(inputstring, list(opdict.keys())) #Get and unpack parse output
+        
+        op = output[0]
+        arguments = output[1]
+        remainder = output[2]
 
-    function = opdict[op] #The function to be executed from the operator
-    parsedvals = [] #parsing the arguments
+        function = opdict[op] #The function to be executed from the operator
+        parsedvals = [] #parsing the arguments
 
-    if op == "???": #metaparse directly works with the conditional operator
-        
-        if metaparse(arguments[0])[0] == 0:
-            parsedvals.append(metaparse(arguments[1])[0])
+        if op == "???": #metaparse directly works with the conditional operator
             
-        else:
-            parsedvals.append(metaparse(arguments[2])[0])
+            if metaparse(arguments[0])[0] == 0:
+                parsedvals.append(metaparse(arguments[1])[0])
+                
+            else:
+                parsedvals.append(metaparse(arguments[2])[0])
+            
+        elif op == "~~": #metaparse works directly with the loop operator
+            
+            while metaparse(arguments[0])[0] == 0:
+                completed = metaparse(arguments[1])[0]
+                if not parsedvals: #The loop returns the value of its first iteration, so that is the only one
+                                   #we keep; storing every iteration would leak memory in endless loops.
+                    parsedvals.append(completed)
+            if not parsedvals: #If the loop never evaluates, the loop body is defined to return 0
+                parsedvals.append(0)
         
-    elif op == "~~": #metaparse works directly with the loop operator
+        else: #everything else ultimately goes through functions
+            for i in arguments:
+                parsedvals.append(metaparse(i)[0])
         
-        while metaparse(arguments[0])[0] == 0:
-            completed = metaparse(arguments[1])[0]
-            parsedvals.append(completed)
-        try: #If the loop never evaluates, the loop body is defined to return 0
-            completed
-        except NameError:
-            parsedvals.append(0)
-    
-    else: #everything else ultimately goes through functions
-        for i in arguments:
-            parsedvals.append(metaparse(i)[0])
-    
-    out = function(parsedvals)
-    if remainder:
-        out = metaparse(remainder)[0]
-    
-    return out, remainder
+        out = function(parsedvals)
+        if sample:
+            note(op, out)
+        if not remainder:
+            return out, remainder
+
+        inputstring = remainder
 
 def nocomments(inputstr):
     """nocomments removes comments, which are of the form #<comment_text># and which do not nest.
@@ -584,60 +741,132 @@ def find_func(inputstr):
     return output
             
 
-def find_pack(inputstr):
-    """find_pack finds OpPack imports in Integ code, executes the corresponding file,
-    and deletes the definition so that metaparse can use it."""
+global fetched #OpPack sources retrieved successfully during this run, by identification number
+fetched = {}
 
-    global oppacks
-    
+global failed #While a program's imports are being executed, the errors met while prefetching them, by identification number
+failed = None
+
+def split_packs(inputstr):
+    """split_packs separates the OpPack imports in Integ code from the rest of the code. It returns the code without the imports,
+    the contents of the imports in order, and whether the last import is missing its closing ."""
     inimport = False
 
     output = ""
     importbody = ""
+    imports = []
     
     for i in inputstr: #Basically, just add characters to the output if they aren't in definitions in the input.
         if i == ".":
             inimport = not inimport
 
             if not inimport:
-                
+                imports.append(importbody)
+                importbody = ""
+
+        if inimport and i != ".":
+            importbody += i
+                    
+        if not inimport and i != ".":
+          output += i
+
+    return output, imports, inimport
+
+def fetch_pack(importnum):
+    """fetch_pack retrieves the source of an OpPack. It returns the source and None, or None and the error message
+    that find_pack prints when it reaches the import, so that errors still surface in the order of the imports."""
+    try: #Trying to get the URL of the OpPack; you have to decode it if it comes from GitHub
+        if registry:
+            file = request.urlopen(registry.rstrip("/") + "/" + str(importnum))
+            pack = codecs.decode(file.read()).strip()
+            file.close()
+        else:
+            with githublock: #PyGithub shares one connection between requests, so only the download below runs concurrently
+                pack = codecs.decode(base64.b64decode(oppacks.get_file_contents(str(importnum)).content))
+    except:
+        return None, "OpPack " + str(importnum) + " may not exist, or there may be connection errors. Opening failed."
+
+    try: #Trying to get the OpPack
+        file = request.urlopen(pack)
+        script = codecs.decode(file.read())
+        file.close()
+    except:
+        return None, "OpPack " + str(importnum) + " could not be opened."
+
+    return script.replace(" ", "").replace("\n", "").replace("\t", "").replace("\r", ""), None
+
+def prefetch(inputstr):
+    """prefetch retrieves, concurrently, every OpPack that Integ code imports, along with the OpPacks those import, and so on.
+    Each OpPack is retrieved only once per run no matter how often it is imported; find_pack then executes them in order.
+    Sources that were retrieved are kept in fetched; the errors for those that could not be are returned, so they can be retried later."""
+    errors = {}
+
+    with ThreadPoolExecutor(max_workers = 8) as pool:
+        pending = {}
+
+        def queue(code):
+            """Starts retrieving the OpPacks imported by code that have not been retrieved or tried yet."""
+            for i in split_packs(code)[1]:
                 try:
-                    importnum = int(importbody) #We get the integer that refers to the OpPack
+                    importnum = int(i)
                 except ValueError:
-                    print("OpPack imports only contain a single, non-negative integer. This integer identifies the OpPack to be imported.")
-                    sys.exit()
-                    
-                if importnum < 0:
-                    print("OpPack imports only contain a single, non-negative integer. This integer identifies the OpPack to be imported.")
-                    sys.exit()
+                    continue #find_pack will complain about this import when it reaches it
+                if importnum >= 0 and importnum not in fetched and importnum not in errors and importnum not in pending.values():
+                    pending[pool.submit(fetch_pack, importnum)] = importnum
 
-                try: #Trying to get the URL of the OpPack; you have to decode it
-                    pack = codecs.decode(base64.b64decode(oppacks.get_file_contents(str(importnum)).content))
-                except:
-                    print("OpPack " + str(importnum) + " may not exist, or there may be connection errors. Opening failed.")
-                    sys.exit()
+        queue(inputstr)
 
-                try: #Trying to get the OpPack
-                    file = request.urlopen(pack)
-                except:
-                    print("OpPack " + str(importnum) + " could not be opened.")
-                    sys.exit()
+        while pending:
+            for future in wait(pending, return_when = FIRST_COMPLETED)[0]:
+                importnum = pending.pop(future)
+                script, error = future.result()
 
-                script = codecs.decode(file.read())
-                
-                execute(script.replace(" ", "").replace("\n", "").replace("\t", "").replace("\r", ""))
-                
-                file.close()
-                
-                importbody = ""
+                if error:
+                    errors[importnum] = error
+                else:
+                    fetched[importnum] = script
+                    if not script.count("#") % 2: #Otherwise nocomments stops the program; execute reports that when the OpPack runs
+                        queue(nocomments(script)) #Imports are found in the OpPack just as execute will find them
 
+    return errors
+
+def find_pack(inputstr):
+    """find_pack finds OpPack imports in Integ code, executes the corresponding file,
+    and deletes the definition so that metaparse can use it."""
+    global failed
+
+    output, imports, inimport = split_packs(inputstr)
+
+    outermost = failed is None
+    if outermost: #All of the network round trips happen here, at the same time. The OpPacks imported by OpPacks were retrieved along with them.
+        failed = prefetch(inputstr)
+
+    try:
+        for importbody in imports:
+            try:
+                importnum = int(importbody) #We get the integer that refers to the OpPack
+            except ValueError:
+                print("OpPack imports only contain a single, non-negative integer. This integer identifies the OpPack to be imported.")
+                sys.exit()
                 
+            if importnum < 0:
+                print("OpPack imports only contain a single, non-negative integer. This integer identifies the OpPack to be imported.")
+                sys.exit()
 
-        if inimport and i != ".":
-            importbody += i
-                    
-        if not inimport and i != ".":
-          output += i
+            if importnum not in fetched:
+                if importnum in failed:
+                    error = failed[importnum]
+                else:
+                    script, error = fetch_pack(importnum)
+                if error:
+                    print(error)
+                    sys.exit()
+                fetched[importnum] = script
+            
+            execute(fetched[importnum])
+    finally:
+        if outermost:
+            failed = None #Errors are not kept past the program that met them, so a later program tries again
 
     if inimport:
         c.connection.privmsg(channel, author + ": Import not terminated with closing .")
@@ -653,13 +882,19 @@ githubac = Github()
 global oppacks
 oppacks = None
 
+githublock = threading.Lock() #Only one thread at a time may use oppacks
+
+global registry #A server standing in for the GitHub repo, such as a local one for testing; <registry>/x holds the URL of OpPack x
+registry = os.environ.get("INTEG_OPPACKS")
+
 useops = True
 
-try:
-    oppacks = githubac.get_repo("kerbin111/Integ_OpPacks")
-except:
-    print("Couldn't access the Github repo. Integ will ignore any OpPack imports.")
-    useops = False
+if not registry:
+    try:
+        oppacks = githubac.get_repo("kerbin111/Integ_OpPacks")
+    except:
+        print("Couldn't access the Github repo. Integ will ignore any OpPack imports.")
+        useops = False
 
 
 global opdict
@@ -743,5 +978,118 @@ def execute(string1 = None):
                 print("\nKeyboard Interrupt.")
         except RecursionError:
                 print("\nImplementation-Specific Error: Recursion limit exceeded.")
-            
-execute()
+
+def worker(number, jobs, preloaded, lock):
+    """worker runs Integ programs taken from the queue jobs until it receives None. Every job starts with a fresh tape
+       and with only the preloaded operators, which were inherited from the parent process when the worker was forked.
+       The output of each job is collected and written out in one piece, under its path, while holding lock."""
+    global numarray, offset
+    import io
+
+    count = 0
+    busy = 0 #Time spent running jobs, not waiting for them
+    stdout = sys.stdout
+
+    while True:
+        path = jobs.get()
+        if path is None:
+            break
+
+        start = time.time()
+
+        del numarray[:] #Every job gets a fresh tape...
+        offset = 0
+        opdict.clear() #...and forgets the operators defined by the previous job, but not the preloaded ones.
+        opdict.update(preloaded)
+
+        sys.stdout = io.StringIO()
+        try:
+            with open(path) as job:
+                execute(job.read())
+        except OSError:
+            print("\nJob " + path + " could not be opened.")
+        except SystemExit:
+            pass #An error in one job should not take the worker down with it.
+        except Exception as error:
+            print("\nJob " + path + " failed: " + repr(error), file=sys.stderr)
+        finally:
+            output = sys.stdout.getvalue()
+            sys.stdout = stdout
+
+        with lock:
+            stdout.write("==> " + path + " <==\n" + output + "\n")
+            stdout.flush()
+
+        count += 1
+        busy += time.time() - start
+
+    print("\nWorker " + str(number) + ": " + str(count) + " jobs in " + str(round(busy, 3)) + " seconds (" +
+          str(round(count / busy, 3) if busy else count) + " jobs/second).", file=sys.stderr)
+
+def prefork(workers, libraries):
+    """prefork executes the operator libraries once and then forks workers that share the resulting operators copy-on-write.
+       The paths of the programs to be run are read from the standard input, one per line, and handed to whichever
+       worker is free."""
+    import multiprocessing
+
+    for i in libraries:
+        try:
+            with open(i) as library:
+                execute(library.read())
+        except OSError:
+            print("\nLibrary " + i + " could not be opened.")
+            sys.exit()
+
+    preloaded = opdict.copy()
+
+    context = multiprocessing.get_context("fork") #Forking is what lets the workers share the preloaded operators.
+    jobs = context.Queue()
+    lock = context.Lock() #Keeps the outputs of different jobs from being mixed together
+    pool = [context.Process(target = worker, args = (i, jobs, preloaded, lock)) for i in range(workers)]
+
+    for i in pool:
+        i.start()
+
+    for line in sys.stdin:
+        line = line.strip()
+        if line:
+            jobs.put(line)
+
+    for i in pool:
+        jobs.put(None) #One stop signal for each worker
+
+    for i in pool:
+        i.join()
+
+    for i in pool:
+        if i.exitcode:
+            print("\nA worker stopped unexpectedly; some jobs may not have been run.", file=sys.stderr)
+            sys.exit(1)
+
+if len(sys.argv) > 2 and sys.argv[1] == "--prefork": #Integ.py --prefork <number of workers> [operator libraries...]
+    try:
+        workers = int(sys.argv[2])
+    except ValueError:
+        print("The number of workers must be a positive integer.")
+        sys.exit()
+
+    if workers < 1:
+        print("The number of workers must be a positive integer.")
+        sys.exit()
+
+    prefork(workers, sys.argv[3:])
+elif len(sys.argv) > 2 and sys.argv[1] in ("--record", "--replay"): #Integ.py --record <trace> [sampling interval] or Integ.py --replay <trace>
+    if sys.argv[1] == "--record" and len(sys.argv) > 3:
+        try:
+            sample = int(sys.argv[3])
+        except ValueError:
+            sample = -1
+
+        if sample < 0:
+            print("The sampling interval must be a non-negative integer.")
+            sys.exit()
+
+    starttrace(sys.argv[1][2:], sys.argv[2])
+    execute()
+else:
+    execute()
@@ -0,0 +1,46 @@
+"""Regression tests for metaparse. Integ.py runs its program as soon as it is loaded, so every test runs it in a subprocess
+with the program on the standard input."""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("github") #Integ.py imports it unconditionally
+
+INTEG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Integ.py")
+
+def run(program):
+    """Runs an Integ program and returns its output. INTEG_OPPACKS is set so that Integ does not contact GitHub."""
+    env = dict(os.environ, INTEG_OPPACKS = "http://127.0.0.1:9")
+    return subprocess.run([sys.executable, INTEG], input = program, capture_output = True, text = True, env = env, check = True).stdout
+
+def peak_rss(program):
+    """Runs an Integ program and returns the peak memory of that run alone, in kilobytes."""
+    env = dict(os.environ, INTEG_OPPACKS = "http://127.0.0.1:9")
+    process = subprocess.Popen([sys.executable, INTEG], stdin = subprocess.PIPE, stdout = subprocess.DEVNULL, text = True, env = env)
+    process.stdin.write(program)
+    process.stdin.close()
+    status, usage = os.wait4(process.pid, 0)[1:]
+    process.returncode = os.waitstatus_to_exitcode(status)
+    assert process.returncode == 0
+    return usage.ru_maxrss // 1024 if sys.platform == "darwin" else usage.ru_maxrss #MacOS reports bytes, Linux kilobytes
+
+def counting_loop(iterations):
+    """An Integ program that counts from 0 to iterations in a loop."""
+    return "}()(0)~(<({())(" + str(iterations) + "))(}()(+({())(1)))"
+
+@pytest.mark.skipif(not hasattr(os, "wait4"), reason = "Measuring the memory of a single run needs os.wait4 (Unix/MacOS).")
+def test_loop_memory_stays_flat():
+    small = peak_rss(counting_loop(10000))
+    large = peak_rss(counting_loop(250000))
+
+    assert large - small < 2048 #Keeping every iteration's value costs about 8 MB here
+
+def test_loop_returns_first_iteration():
+    assert run("](+(48)(~(1)(5)))").endswith("0") #A loop that never runs returns 0
+    assert run("}()(0)](+(48)(~({())(}()(+({())(1)))))").endswith("1")
+
+def test_long_sequence_does_not_recurse():
+    assert run("](65)" * 5000).endswith("A" * 5000)
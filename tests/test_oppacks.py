@@ -0,0 +1,76 @@
+"""Tests for OpPack imports, served from a local stand-in for the registry through INTEG_OPPACKS.
+Integ.py is run in a subprocess with the program on the standard input."""
+
+import collections
+import http.server
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+pytest.importorskip("github") #Integ.py imports it unconditionally
+
+INTEG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Integ.py")
+
+PACKS = {
+    0: ":0B}()(66):](66)", #Prints B and defines B
+    1: ".0.:0C}()(67):](67)", #Imports 0, then prints C and defines C
+    2: "](68)", #Prints D
+}
+
+@pytest.fixture
+def registry(tmp_path):
+    """Serves PACKS from 127.0.0.1: /x holds the URL of OpPack x, which is served at /px.int. Yields the address of the
+    registry and a counter of the requests made for each path."""
+    hits = collections.Counter()
+
+    class Handler(http.server.SimpleHTTPRequestHandler):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, directory = str(tmp_path), **kwargs)
+
+        def do_GET(self):
+            hits[self.path] += 1
+            super().do_GET()
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    address = "http://127.0.0.1:" + str(server.server_address[1])
+    for number, pack in PACKS.items():
+        (tmp_path / str(number)).write_text(address + "/p" + str(number) + ".int\n")
+        (tmp_path / ("p" + str(number) + ".int")).write_text(pack)
+
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    yield address, hits
+    server.shutdown()
+    server.server_close()
+
+def run(program, address):
+    """Runs an Integ program that imports its OpPacks from the registry at address and returns its output."""
+    env = dict(os.environ, INTEG_OPPACKS = address)
+    return subprocess.run([sys.executable, INTEG], input = program, capture_output = True, text = True, env = env, timeout = 60).stdout
+
+def test_transitive_imports_are_fetched(registry):
+    address, hits = registry
+
+    assert run(".1.](B(20))](C(20))", address) == "BCBC"
+    assert hits == {"/0": 1, "/1": 1, "/p0.int": 1, "/p1.int": 1}
+
+def test_repeated_imports_are_fetched_once_and_run_in_order(registry):
+    address, hits = registry
+
+    assert run(".2..1..2.", address) == "DBCD"
+    assert hits["/2"] == hits["/p2.int"] == 1
+
+def test_missing_pack_fails_at_its_own_import(registry):
+    address, hits = registry
+    output = run(".2..9..1.", address)
+
+    assert output.startswith("D") #The import before the missing one has run...
+    assert "OpPack 9 may not exist" in output
+    assert "B" not in output and "C" not in output #...but the one after it has not
+    assert hits["/1"] == 1 #Even though it was fetched ahead of time
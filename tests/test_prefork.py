@@ -0,0 +1,59 @@
+"""Tests for prefork mode. Integ.py is run in a subprocess with the paths of the jobs on the standard input."""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("github") #Integ.py imports it unconditionally
+
+if not hasattr(os, "fork"):
+    pytest.skip("Prefork mode needs fork (Unix/MacOS).", allow_module_level = True)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INTEG = os.path.join(ROOT, "Integ.py")
+
+def prefork(tmp_path, *jobs):
+    """Runs each Integ program in jobs, in order, with a single worker that has the standard library preloaded.
+    Returns the finished process; its stdout holds the output of each job under a line naming it."""
+    paths = []
+    for number, program in enumerate(jobs):
+        path = tmp_path / (str(number) + ".int")
+        if program is not None: #None stands for a job whose file is missing
+            path.write_text(program)
+        paths.append(str(path))
+
+    env = dict(os.environ, INTEG_OPPACKS = "http://127.0.0.1:9") #Keeps Integ from contacting GitHub
+    return subprocess.run([sys.executable, INTEG, "--prefork", "1", os.path.join(ROOT, "stdlib.int")], input = "\n".join(paths) + "\n",
+                          capture_output = True, text = True, env = env, timeout = 60)
+
+def outputs(process):
+    """Splits the stdout of prefork into the outputs of the jobs, in order."""
+    return [block.split("\n", 1)[1].rstrip("\n") for block in process.stdout.split("==> ")[1:]]
+
+def test_jobs_use_preloaded_operators(tmp_path):
+    process = prefork(tmp_path, "](+(48)(N(10)(0)))", "](+(48)(N(10)(5)))")
+
+    assert outputs(process) == ["1", "0"]
+    assert "Worker 0: 2 jobs" in process.stderr
+    assert process.returncode == 0
+
+def test_tape_is_reset_between_jobs(tmp_path):
+    process = prefork(tmp_path, "}(20)(1)](+(48)(@(0)))", "](+(48)(@(0)))")
+
+    assert outputs(process) == ["D", "/"] #@ is 20, then -1 again
+
+def test_operators_do_not_leak_between_jobs(tmp_path):
+    process = prefork(tmp_path, ":0Z}()(65):](Z(10))", ":0Z}()(66):](Z(10))")
+
+    assert outputs(process) == ["A", "B"]
+
+def test_failing_jobs_do_not_stop_the_worker(tmp_path):
+    process = prefork(tmp_path, "](/(1)(0))", None, "](65)")
+
+    assert "failed" in process.stderr
+    assert "could not be opened" in outputs(process)[1]
+    assert outputs(process)[2] == "A"
+    assert "Worker 0: 3 jobs" in process.stderr
+    assert process.returncode == 0
@@ -0,0 +1,79 @@
+"""Tests for recording and replaying traces. Integ.py is run in a subprocess with the program on the standard input."""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("github") #Integ.py imports it unconditionally
+
+INTEG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Integ.py")
+
+RANDOM = "](+(48)(%(\"(0))(10)))](+(48)(`(0)(9)))](+(48)(`(0)(9)))](+(48)(`(0)(9)))" #One time and three random digits
+
+def run(program, *args):
+    """Runs an Integ program with the given command line arguments and returns the finished process."""
+    env = dict(os.environ, INTEG_OPPACKS = "http://127.0.0.1:9") #Keeps Integ from contacting GitHub
+    return subprocess.run([sys.executable, INTEG] + list(args), input = program, capture_output = True, text = True, env = env, timeout = 60)
+
+def varint(number):
+    """The zigzag varint the trace format uses for number, worked out independently of Integ.py."""
+    number = number * 2 if number >= 0 else -number * 2 - 1
+    out = b""
+    while True:
+        if number < 128:
+            return out + bytes([number])
+        out += bytes([number % 128 + 128])
+        number //= 128
+
+def test_replay_reproduces_the_run(tmp_path):
+    trace = str(tmp_path / "trace.bin")
+    recorded = run(RANDOM, "--record", trace)
+
+    assert recorded.stdout
+    assert not recorded.stderr #No traceback from the thread that flushes the trace
+    assert run(RANDOM, "--replay", trace).stdout == recorded.stdout
+
+@pytest.mark.parametrize("number", [0, 1, -1, 63, -64, 64, 300, -1000000, 2 ** 40, -(2 ** 70)])
+def test_values_round_trip(tmp_path, number):
+    trace = tmp_path / "trace.bin"
+    run("`(" + str(number) + ")(" + str(number) + ")", "--record", str(trace))
+
+    assert trace.read_bytes() == b"ITR1`" + varint(number)
+
+    replayed = run("](-(`(0)(0))(" + str(number - 65) + "))", "--replay", str(trace)) #Prints A if ` returns number
+
+    assert replayed.stdout.endswith("A")
+    assert not replayed.stderr
+
+def test_trace_that_does_not_match(tmp_path):
+    trace = str(tmp_path / "trace.bin")
+    run("`(1)(1)", "--record", trace)
+
+    assert "does not match" in run("\"(0)", "--replay", trace).stdout
+    assert "ended before the program did" in run("`(0)(0)`(0)(0)", "--replay", trace).stdout
+
+def test_truncated_trace(tmp_path):
+    trace = tmp_path / "trace.bin"
+    run("`(" + str(2 ** 40) + ")(" + str(2 ** 40) + ")", "--record", str(trace))
+    trace.write_bytes(trace.read_bytes()[:-2])
+
+    assert "truncated" in run("`(0)(0)", "--replay", str(trace)).stdout
+
+def test_leftover_values_are_reported(tmp_path):
+    trace = str(tmp_path / "trace.bin")
+    run(RANDOM, "--record", trace)
+
+    assert "4 recorded values were not used" in run("](65)", "--replay", trace).stderr
+
+def test_replay_skips_sampled_events(tmp_path):
+    trace = tmp_path / "trace.bin"
+    recorded = run(RANDOM, "--record", str(trace), "1")
+
+    assert b"o" in trace.read_bytes()[4:]
+
+    replayed = run(RANDOM, "--replay", str(trace))
+
+    assert replayed.stdout == recorded.stdout
+    assert not replayed.stderr